@@ -1 +1,60 @@
+"""
+The framework's public API.
 
+Submodules are only imported when one of their names is first accessed, so
+that a worker does not pay for parts of the framework it does not use.
+"""
+
+import importlib
+
+from .compat import PY2
+
+# Public name -> submodule providing it
+_exports = {
+    'BaseApplication': 'app',
+    'BaseEchoApplication': 'app',
+    'ProxyApplication': 'app',
+    'Application': 'app',
+    'EchoApplication': 'app',
+    'RateLimitApplication': 'ratelimit',
+    'AccessLogApplication': 'accesslog',
+    'Config': 'config',
+    'Error': 'error',
+    'Request': 'request',
+    'Response': 'response',
+    'DefaultResponse': 'response',
+    'Template': 'template',
+    'TemplateLoader': 'template',
+    'TemplateError': 'template',
+    'Safe': 'template',
+    'cached': 'cache',
+    'create_cache': 'cache',
+    'ConnectionPool': 'db',
+    'PoolManager': 'db',
+    'TaskExecutor': 'tasks',
+    'build_manifest': 'manifest',
+    'load_manifest': 'manifest'
+}
+
+__all__ = sorted(_exports)
+
+
+def __getattr__(name):
+    module = _exports.get(name)
+    if module is None:
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
+
+
+if PY2:
+    # Module level __getattr__ is not supported, so import eagerly
+    for _name in _exports:
+        __getattr__(_name)
+    del _name
@@ -0,0 +1,387 @@
+"""
+Buffered access logging.
+
+AccessLogApplication wraps another application and is configured under the
+'accesslog' key:
+
+    accesslog.path              -- File to append to, or None for stdout
+    accesslog.format            -- 'combined', 'common', 'json', or a format
+                                   string using the field names below
+    accesslog.buffer_size       -- Number of records the buffer holds
+    accesslog.flush_interval    -- Seconds between writes of the buffer
+
+Records are placed in a preallocated ring buffer and written in batches by a
+background thread, so a request never waits on the log file.  If the buffer
+is full the record is dropped and counted.  A batch that can not be written
+is logged as a warning and counted as failed, and the writer carries on.
+
+In the text formats, '"', '\\' and nonprintable characters in fields are
+escaped as \\", \\\\ and \\xNN as Apache does, so a request can not forge
+log lines.
+
+Format fields:
+
+    host, user, time, request, method, path, query, protocol, status,
+    bytes, referer, agent, route, mount, duration (microseconds)
+"""
+
+import atexit
+import json
+import logging
+import os
+import re
+import string
+import sys
+import threading
+import time
+
+from .config import Config
+from .app import BaseApplication
+from .error import Error
+
+
+logger = logging.getLogger(__name__)
+
+
+class AccessLogError(Error):
+    """ An error with the access log. """
+    pass
+
+
+# Record layout, a tuple in this order
+(_HOST, _USER, _TIME, _METHOD, _PATH, _QUERY, _PROTOCOL, _STATUS, _BYTES,
+ _REFERER, _AGENT, _ROUTE, _MOUNT, _DURATION) = range(14)
+
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def _format_time(when):
+    """ Format a time as in the common log format. """
+    t = time.gmtime(when)
+    return "{0:02d}/{1}/{2:04d}:{3:02d}:{4:02d}:{5:02d} +0000".format(
+        t.tm_mday, _MONTHS[t.tm_mon - 1], t.tm_year, t.tm_hour, t.tm_min, t.tm_sec)
+
+
+# Characters escaped in the text formats
+_unsafe = re.compile(r'[^\x20-\x7e]|["\\]')
+
+
+def _escape_char(match):
+    ch = match.group()
+    if ch == '"' or ch == '\\':
+        return '\\' + ch
+    code = ord(ch)
+    if code < 0x100:
+        return '\\x{0:02x}'.format(code)
+    return '\\u{0:04x}'.format(code)
+
+
+def _escape(value):
+    """ Escape a field value for the text formats. """
+    if not value:
+        return '-'
+    return _unsafe.sub(_escape_char, value)
+
+
+def _format_request(record):
+    path = record[_PATH]
+    if record[_QUERY]:
+        path += '?' + record[_QUERY]
+    return _escape("{0} {1} {2}".format(record[_METHOD], path, record[_PROTOCOL]))
+
+
+_FIELDS = {
+    'host': lambda r: _escape(r[_HOST]),
+    'user': lambda r: _escape(r[_USER]),
+    'time': lambda r: _format_time(r[_TIME]),
+    'request': _format_request,
+    'method': lambda r: _escape(r[_METHOD]),
+    'path': lambda r: _escape(r[_PATH]),
+    'query': lambda r: _escape(r[_QUERY]),
+    'protocol': lambda r: _escape(r[_PROTOCOL]),
+    'status': lambda r: r[_STATUS],
+    'bytes': lambda r: r[_BYTES] or '-',
+    'referer': lambda r: _escape(r[_REFERER]),
+    'agent': lambda r: _escape(r[_AGENT]),
+    'route': lambda r: _escape(r[_ROUTE]),
+    'mount': lambda r: _escape(r[_MOUNT]),
+    'duration': lambda r: int(r[_DURATION] * 1000000)
+}
+
+_FORMATS = {
+    'common': '{host} - {user} [{time}] "{request}" {status} {bytes}',
+    'combined': '{host} - {user} [{time}] "{request}" {status} {bytes} "{referer}" "{agent}"'
+}
+
+
+def _format_json(record):
+    return json.dumps({
+        'host': record[_HOST],
+        'user': record[_USER],
+        'time': record[_TIME],
+        'method': record[_METHOD],
+        'path': record[_PATH],
+        'query': record[_QUERY],
+        'protocol': record[_PROTOCOL],
+        'status': record[_STATUS],
+        'bytes': record[_BYTES],
+        'referer': record[_REFERER],
+        'agent': record[_AGENT],
+        'route': record[_ROUTE],
+        'mount': record[_MOUNT],
+        'duration': record[_DURATION]
+    }, sort_keys=True, separators=(',', ':')) + '\n'
+
+
+def compile_format(format):
+    """ Compile a log format into a function formatting a record as a line. """
+    if format == 'json':
+        return _format_json
+
+    format = _FORMATS.get(format, format)
+
+    getters = []
+    for (literal, name, spec, conversion) in string.Formatter().parse(format):
+        if name is None:
+            continue
+        if not name in _FIELDS:
+            raise AccessLogError("Unknown access log field: {0}".format(name))
+        getters.append((name, _FIELDS[name]))
+
+    template = (format + '\n').format
+    getters = tuple(dict(getters).items())
+
+    def formatter(record):
+        return template(**dict((name, getter(record)) for (name, getter) in getters))
+
+    return formatter
+
+
+class AccessLog(object):
+    """ A ring buffer of access records written by a background thread. """
+
+    _default_config = {
+        'path': None,
+        'format': 'combined',
+        'buffer_size': 8192,
+        'flush_interval': 1.0
+    }
+
+    def __init__(self, config=None):
+        self._config = Config(self._default_config, config)
+        self._path = self._config.get('path')
+        self._formatter = compile_format(self._config.get('format'))
+        self._interval = float(self._config.get('flush_interval'))
+
+        self._size = int(self._config.get('buffer_size'))
+        self._buffer = [None] * self._size
+        self._head = 0 # Next record to write out
+        self._count = 0
+        self._notify_at = self._size // 2
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+
+        self._written = 0
+        self._dropped = 0
+        self._failed = 0
+        self._pid = None
+        self._handle = None
+        self._writer = None
+        self._closed = False
+
+        # Opened now so that a bad path fails at startup
+        if self._path is not None:
+            try:
+                self._handle = open(self._path, 'a')
+            except (IOError, OSError) as e:
+                raise AccessLogError("Unable to open access log: {0}: {1}".format(self._path, e))
+
+    def record(self, record):
+        """ Add a record to the buffer.  Returns False if it was dropped. """
+        if self._pid != os.getpid():
+            self._start()
+
+        with self._lock:
+            count = self._count
+            if count == self._size:
+                self._dropped += 1
+                return False
+
+            self._buffer[(self._head + count) % self._size] = record
+            self._count = count + 1
+
+        if count + 1 == self._notify_at:
+            self._event.set()
+        return True
+
+    def _start(self):
+        """ Start the writer in this process if not already running. """
+        with self._lock:
+            pid = os.getpid()
+            if self._pid == pid:
+                return
+
+            # Records buffered by a parent process are its to write
+            self._head = 0
+            self._count = 0
+            self._event = threading.Event()
+            self._writer = threading.Thread(target=self._run, name="access-log-writer")
+            self._writer.daemon = True
+            self._writer.start()
+
+            if self._pid is None:
+                atexit.register(self.close)
+            self._pid = pid
+
+    def _run(self):
+        """ Writer thread loop. """
+        while not self._closed:
+            self._event.wait(self._interval)
+            self._event.clear()
+            self.flush()
+
+    def _take(self):
+        """ Remove and return the buffered records. """
+        with self._lock:
+            head = self._head
+            count = self._count
+            end = head + count
+            if end <= self._size:
+                records = self._buffer[head:end]
+            else:
+                records = self._buffer[head:] + self._buffer[:end - self._size]
+
+            for i in range(head, end):
+                self._buffer[i % self._size] = None
+            self._head = end % self._size
+            self._count = 0
+
+        return records
+
+    def flush(self):
+        """ Write out the buffered records.  Errors are logged and the
+            records counted as failed, so the writer keeps running.
+        """
+        records = self._take()
+        if not records:
+            return
+
+        try:
+            formatter = self._formatter
+            data = ''.join([formatter(record) for record in records])
+
+            handle = sys.stdout if self._path is None else self._handle
+            handle.write(data)
+            handle.flush()
+        except Exception:
+            self._failed += len(records)
+            logger.warning("Unable to write %d access log records", len(records), exc_info=True)
+            return
+
+        self._written += len(records)
+
+    def close(self):
+        """ Stop the writer and write out what is left. """
+        if self._closed:
+            return
+        self._closed = True
+
+        if self._writer is not None and self._pid == os.getpid():
+            self._event.set()
+            self._writer.join()
+            self.flush()
+
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def stats(self):
+        """ Return the written, dropped, failed and buffered record counts. """
+        return {
+            'written': self._written,
+            'dropped': self._dropped,
+            'failed': self._failed,
+            'buffered': self._count
+        }
+
+
+class _LoggedIterator(object):
+    """ Count the bytes of a response and record it when closed. """
+
+    def __init__(self, iterable, done):
+        self._iterable = iterable
+        self._done = done
+        self.bytes = 0
+
+    def __iter__(self):
+        for chunk in self._iterable:
+            self.bytes += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self._iterable, 'close'):
+                self._iterable.close()
+        finally:
+            self._done(self.bytes)
+
+
+class AccessLogApplication(BaseApplication):
+    """ An application that logs the requests passed to another. """
+
+    def __init__(self, config, app):
+        """ Create the access logging application wrapping app. """
+        BaseApplication.__init__(self)
+        self._config = Config(config)
+        self._app = app
+        self._log = AccessLog(self._config.get('accesslog'))
+
+    def __call__(self, environ, start_response):
+        """ Pass the request on and log it when the response is closed. """
+        start = time.time()
+        status = []
+
+        # Captured before an inner application changes them
+        script_name = environ.get('SCRIPT_NAME', '')
+        path_info = environ.get('PATH_INFO', '')
+
+        def logging_start_response(response_status, headers, exc_info=None):
+            status[:] = [response_status]
+            if exc_info is None:
+                return start_response(response_status, headers)
+            return start_response(response_status, headers, exc_info)
+
+        def done(sent):
+            code = status[0].split(None, 1)[0] if status else '500'
+            self._log.record((
+                environ.get('REMOTE_ADDR'),
+                environ.get('REMOTE_USER'),
+                start,
+                environ.get('REQUEST_METHOD', 'GET'),
+                script_name + path_info,
+                environ.get('QUERY_STRING'),
+                environ.get('SERVER_PROTOCOL', 'HTTP/1.0'),
+                code,
+                sent,
+                environ.get('HTTP_REFERER'),
+                environ.get('HTTP_USER_AGENT'),
+                environ.get('mrbavii.pysite.route'),
+                environ.get('mrbavii.pysite.mount'),
+                time.time() - start
+            ))
+
+        try:
+            result = self._app(environ, logging_start_response)
+        except:
+            done(0)
+            raise
+
+        return _LoggedIterator(result, done)
+
+    def stats(self):
+        """ Return the access log counters. """
+        return self._log.stats()
+
+    def close(self):
+        """ Write out the remaining records and stop the writer. """
+        self._log.close()
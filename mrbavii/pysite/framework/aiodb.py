@@ -0,0 +1,156 @@
+"""
+Pooled database connections for asyncio.
+
+This uses the same configuration as the thread safe pool in the db module.
+The connect callable may return either a connection or an awaitable that
+produces one.  When using the configured driver, the blocking connect call
+is made in the loop's default executor.  The rollback() and close() methods
+of a connection may likewise be coroutines, and are awaited if so.
+"""
+
+import asyncio
+import inspect
+
+from .db import _PoolBase, _clock, _connector, PoolManager, PoolTimeout
+
+
+class AsyncConnectionPool(_PoolBase):
+    """ An asyncio pool of database connections. """
+
+    def __init__(self, config, connect=None):
+        if connect is None:
+            blocking = _connector(config)
+
+            def connect():
+                return asyncio.get_running_loop().run_in_executor(None, blocking)
+
+        _PoolBase.__init__(self, config, connect)
+        self._lock = asyncio.Condition()
+        self._closing = []
+
+    async def acquire(self):
+        """ Check a connection out of the pool. """
+        start = _clock()
+        deadline = start + self._timeout
+        blocked = False
+
+        async with self._lock:
+            while True:
+                conn = self._take_idle()
+                if conn is not None:
+                    self._stats.record_wait(_clock() - start, blocked)
+                    break
+
+                if self._can_create():
+                    self._checked_out += 1
+                    break
+
+                remaining = deadline - _clock()
+                if remaining <= 0:
+                    self._stats.timeouts += 1
+                    raise PoolTimeout("Timed out waiting for a database connection")
+                blocked = True
+                try:
+                    await asyncio.wait_for(self._lock.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+        # Recycled connections taken out of the pool are closed outside the lock
+        await self._finish_closing()
+        if conn is not None:
+            return conn
+
+        try:
+            conn = self._connect()
+            if inspect.isawaitable(conn):
+                conn = await conn
+        except BaseException:
+            async with self._lock:
+                self._checked_out -= 1
+                self._lock.notify()
+            raise
+
+        self._opened(conn)
+        self._stats.record_wait(_clock() - start, blocked)
+        return conn
+
+    async def release(self, conn):
+        """ Return a connection to the pool. """
+        broken = not await self._reset(conn)
+        async with self._lock:
+            self._returned(conn, broken)
+            self._lock.notify()
+        await self._finish_closing()
+
+    async def dispose(self):
+        """ Close all idle connections. """
+        while self._idle:
+            self._close(self._idle.pop()[0])
+        await self._finish_closing()
+
+    async def _reset(self, conn):
+        """ Roll back anything left uncommitted.  Returns False if the
+            connection is no longer usable.
+        """
+        try:
+            result = conn.rollback()
+            if inspect.isawaitable(result):
+                await result
+            return True
+        except Exception:
+            return False
+
+    def _close(self, conn):
+        """ Close a connection, keeping the result to await if the driver
+            closes asynchronously.
+        """
+        self._created.pop(id(conn), None)
+        try:
+            result = conn.close()
+        except Exception:
+            return
+        if inspect.isawaitable(result):
+            self._closing.append(result)
+
+    async def _finish_closing(self):
+        """ Await the connections being closed. """
+        while self._closing:
+            try:
+                await self._closing.pop()
+            except Exception:
+                pass
+
+
+class AsyncPoolManager(PoolManager):
+    """ Create the configured asyncio pools on first use. """
+
+    def __init__(self, config):
+        PoolManager.__init__(self, config, AsyncConnectionPool)
+
+    async def dispose(self):
+        """ Close the idle connections of all pools. """
+        for pool in list(self._pools.values()):
+            await pool.dispose()
+
+
+class AsyncConnections(object):
+    """ The connections checked out for a single asyncio request. """
+
+    def __init__(self, manager):
+        self._manager = manager
+        self._connections = {}
+
+    async def get(self, name):
+        """ Get the connection for the named database. """
+        conn = self._connections.get(name)
+        if conn is None:
+            conn = await self._manager.get(name).acquire()
+            self._connections[name] = conn
+        return conn
+
+    async def release(self):
+        """ Return all checked out connections to their pools. """
+        connections = self._connections
+        self._connections = {}
+        for name in connections:
+            await self._manager.get(name).release(connections[name])
@@ -2,12 +2,16 @@
 This is the application class.
 """
 
+import atexit
 import re
 
+from .cache import cached, create_cache
 from .config import Config
+from .db import PoolManager
 from .request import Request
 from .response import Response, DefaultResponse
-from .util import convert_to_bytes
+from .tasks import TaskExecutor
+from .util import ClosingIterator
 from .compat import u
 
 class BaseApplication(object):
@@ -61,6 +65,7 @@ class ProxyApplication(BaseApplication):
                     environ['SCRIPT_NAME'] += path_info[:len(path)]
                     environ['PATH_INFO'] = path_info[len(path):]
 
+                environ['mrbavii.pysite.mount'] = path
                 return app(environ, start_response)
         else:
             return self._app(environ, start_response)
@@ -74,50 +79,105 @@ class Application(BaseApplication):
         'server.request.uploads.max_size': 1024000,
         'server.request.uploads.max_count': 1,
         'server.response.default.content_type': 'application/octet-stream',
-        'server.response.default.encoding': 'utf-8'
+        'server.response.default.encoding': 'utf-8',
+        'server.response.block_size': 65536,
+        'cache.backend': 'memory',
+        'cache.max_entries': 1024,
+        'cache.max_size': 0,
+        'cache.ttl': 0,
+        'tasks.mode': 'thread',
+        'tasks.threads': 4,
+        'tasks.processes': 2,
+        'tasks.queue_size': 1000,
+        'tasks.submit_timeout': 0
     }
 
     def __init__(self, config):
         BaseApplication.__init__(self)
         self._config = Config(self._default_config, config)
         self._routes = []
+        self._compiled_routes = None
+        self._pools = PoolManager(self._config)
+        self._cache = create_cache(self._config.get('cache'))
+        self._tasks = TaskExecutor(self._config.get('tasks'))
+        atexit.register(self.shutdown)
     
     def get_response(self, request):
         """ Handle the request with routes. """
-        for i in self.routes:
-            mo = i[0].match(requset, pathinfo)
+        routes = self._compiled_routes
+        if routes is None:
+            # Compile on first dispatch rather than at startup
+            routes = self._compiled_routes = [(re.compile(i[0]), i[1]) for i in self._routes]
+
+        for i in routes:
+            mo = i[0].match(request.pathinfo)
             if mo:
+                request.route = i[0].pattern
                 return i[1](request, mo)
         else:
             return None
 
-    def route(self, route, fn):
-        """ Register the route. """
-        self.routes.append((re.compile(route), fn))
+    def cached(self, ttl=None, key=None, tags=None):
+        """ Memoize a function using the application's cache. """
+        return cached(ttl, key, tags, self._cache)
 
-    def __call__(self, environ, start_response):
-        """ Handle the application call. """
-        # Handle the request
-        try:
-            request = Request(self._config, environ)
-        except UnicodeError:
-            pass # TODO: handle
-        else:
-            response = self.get_response(request)
+    def invalidate(self, tag):
+        """ Remove every cached entry with the tag. """
+        self._cache.invalidate(tag)
 
-        if response is None:
-            response = DefaultResponse(self._config, 404)
+    def defer(self, fn, *args, **kwargs):
+        """ Run a callable on the background thread pool. """
+        return self._tasks.submit(fn, *args, **kwargs)
 
+    def shutdown(self, wait=True):
+        """ Let queued background tasks finish, stop the workers and close
+            the idle database connections.  This is also called at exit.
+        """
+        self._tasks.shutdown(wait)
+        self._pools.dispose()
 
-        # Prepare status and headers
-        headers = response.prepare()
-        response_status = "{0} {1}".format(str(response.status), response.reason)
-        response_headers = [(i, headers[i]) for i in headers]
-
-        # Return
-        start_response(response_status, response_headers)
+    def route(self, route, fn):
+        """ Register the route.  The pattern is compiled on first use. """
+        self._routes.append((route, fn))
+        self._compiled_routes = None
 
-        return [convert_to_bytes(response._body, response._charset)]
+    def __call__(self, environ, start_response):
+        """ Handle the application call. """
+        request = None
+        response = None
+        try:
+            # Handle the request
+            try:
+                request = Request(self._config, environ, self._pools, self._tasks)
+            except UnicodeError:
+                pass # TODO: handle
+            else:
+                response = self.get_response(request)
+                environ['mrbavii.pysite.route'] = request.route
+
+            if response is None:
+                response = DefaultResponse(self._config, 404)
+
+
+            # Prepare status and headers
+            headers = response.prepare()
+            response_status = "{0} {1}".format(str(response.status), response.reason)
+            response_headers = [(i, headers[i]) for i in headers]
+
+            # Return, the body is streamed and closed by the server
+            start_response(response_status, response_headers)
+
+            if request is None:
+                return ClosingIterator(response)
+            return ClosingIterator(response, request.close)
+        except:
+            # Return pooled connections even if the handler failed, but
+            # drop its deferred tasks
+            if response is not None:
+                response.close()
+            if request is not None:
+                request.close(False)
+            raise
 
 
 class EchoApplication(Application):
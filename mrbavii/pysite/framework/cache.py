@@ -0,0 +1,413 @@
+"""
+Memoization of the data handlers look up.
+
+Caches are configured through the application configuration under the
+'cache' key:
+
+    cache.backend       -- 'memory' for an in-process cache, or 'sqlite' for
+                           a cache shared by all processes using the same file
+    cache.max_entries   -- Maximum number of entries, 0 for no limit
+    cache.max_size      -- Maximum approximate size in bytes, 0 for no limit
+    cache.ttl           -- Default time to live in seconds, 0 to never expire
+    cache.path          -- The database file used by the 'sqlite' backend
+
+Usage:
+
+    @cached(ttl=60, tags=lambda user_id: ['user:{0}'.format(user_id)])
+    def load_profile(user_id):
+        ...
+
+    get_default_cache().invalidate('user:42')
+"""
+
+import collections
+import functools
+import os
+import sys
+import threading
+import time
+
+from .config import Config
+from .error import Error
+
+
+class CacheError(Error):
+    """ An error with a cache. """
+    pass
+
+
+_MISSING = object()
+
+
+def _sizeof(value):
+    """ Approximate the memory used by a value. """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for (k, v) in value.items():
+            size += _sizeof(k) + _sizeof(v)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for v in value:
+            size += _sizeof(v)
+    return size
+
+
+class CacheStats(object):
+    """ Hit and miss counters for a cache. """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def as_dict(self):
+        """ Return the counters as a dictionary. """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': (float(self.hits) / total) if total else 0.0
+        }
+
+
+class BaseCache(object):
+    """ The interface shared by cache backends. """
+
+    _default_config = {
+        'max_entries': 1024,
+        'max_size': 0,
+        'ttl': 0
+    }
+
+    def __init__(self, config=None):
+        self._config = Config(self._default_config, config)
+        self._max_entries = int(self._config.get('max_entries'))
+        self._max_size = int(self._config.get('max_size'))
+        self._ttl = float(self._config.get('ttl'))
+        self._stats = CacheStats()
+
+    def _expires(self, ttl):
+        """ Determine when an entry set now with ttl will expire, 0 for never. """
+        if ttl is None:
+            ttl = self._ttl
+        return (time.time() + ttl) if ttl > 0 else 0.0
+
+    def get(self, key, defval=None):
+        """ Get a value from the cache, or defval if not present. """
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None, tags=None):
+        """ Store a value.
+
+            Parameters:
+
+                key -- The key to store the value under.
+                value -- The value to store.
+                ttl -- Seconds before the entry expires.  None uses the
+                       configured default and 0 never expires.
+                tags -- Tags used to invalidate the entry as part of a group.
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """ Remove an entry. """
+        raise NotImplementedError
+
+    def invalidate(self, tag):
+        """ Remove every entry set with the tag. """
+        raise NotImplementedError
+
+    def clear(self):
+        """ Remove all entries. """
+        raise NotImplementedError
+
+    def stats(self):
+        """ Return the hit ratio and usage of the cache. """
+        return self._stats.as_dict()
+
+
+class MemoryCache(BaseCache):
+    """ A thread safe in-process LRU cache. """
+
+    def __init__(self, config=None):
+        BaseCache.__init__(self, config)
+        self._entries = collections.OrderedDict() # key -> (value, expires, size, tags)
+        self._tags = {} # tag -> set of keys
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, defval=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats.misses += 1
+                return defval
+
+            if entry[1] and entry[1] <= time.time():
+                self._remove(key)
+                self._stats.misses += 1
+                return defval
+
+            # Move to the most recently used position
+            del self._entries[key]
+            self._entries[key] = entry
+            self._stats.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None, tags=None):
+        tags = tuple(tags) if tags else ()
+        size = _sizeof(value)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, self._expires(ttl), size, tags)
+            self._size += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            # Evict least recently used
+            while self._entries and ((self._max_entries and len(self._entries) > self._max_entries) or
+                                     (self._max_size and self._size > self._max_size)):
+                self._remove(next(iter(self._entries)))
+                self._stats.evictions += 1
+
+    def _remove(self, key):
+        (value, expires, size, tags) = self._entries.pop(key)
+        self._size -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def invalidate(self, tag):
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._size = 0
+
+    def stats(self):
+        result = BaseCache.stats(self)
+        result['entries'] = len(self._entries)
+        result['size'] = self._size
+        return result
+
+
+def _pickle():
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    return pickle
+
+
+class SqliteCache(BaseCache):
+    """ A cache shared between processes through an SQLite database.
+
+        Values are pickled, and the pickled length is used for the size.
+        Each process and thread uses its own connection.  Hit and miss
+        counters are per process.  The sqlite3 and pickle modules are only
+        imported when this backend is used.
+    """
+
+    _default_config = dict(BaseCache._default_config, timeout=5.0)
+
+    _schema = (
+        "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, expires REAL, size INTEGER, accessed REAL)",
+        "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)",
+        "CREATE TABLE IF NOT EXISTS tags (tag TEXT, key TEXT, PRIMARY KEY (tag, key))",
+        "CREATE INDEX IF NOT EXISTS tags_key ON tags (key)"
+    )
+
+    def __init__(self, config=None):
+        BaseCache.__init__(self, config)
+        self._path = self._config.get('path')
+        if self._path is None:
+            raise CacheError("The sqlite cache requires a path")
+        self._timeout = float(self._config.get('timeout'))
+        self._local = threading.local()
+
+        with self._connection() as conn:
+            for statement in self._schema:
+                conn.execute(statement)
+
+    def _connection(self):
+        """ Get the connection for the current process and thread. """
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            import sqlite3
+            conn = sqlite3.connect(self._path, timeout=self._timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = pid
+        return self._local.conn
+
+    def get(self, key, defval=None):
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[1] and row[1] <= now):
+                if row is not None:
+                    self._delete(conn, key)
+                self._stats.misses += 1
+                return defval
+
+            conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+
+        self._stats.hits += 1
+        return _pickle().loads(bytes(row[0]))
+
+    def set(self, key, value, ttl=None, tags=None):
+        import sqlite3
+        pickle = _pickle()
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._connection() as conn:
+            self._delete(conn, key)
+            conn.execute("INSERT INTO entries (key, value, expires, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                         (key, sqlite3.Binary(data), self._expires(ttl), len(data), time.time()))
+            if tags:
+                conn.executemany("INSERT OR IGNORE INTO tags (tag, key) VALUES (?, ?)",
+                                 [(tag, key) for tag in tags])
+            self._evict(conn)
+
+    def _delete(self, conn, key):
+        conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        conn.execute("DELETE FROM tags WHERE key = ?", (key,))
+
+    def _evict(self, conn):
+        """ Remove least recently used entries until within limits. """
+        if not (self._max_entries or self._max_size):
+            return
+
+        (count, size) = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if (not self._max_entries or count <= self._max_entries) and (not self._max_size or size <= self._max_size):
+            return
+
+        for (key, entry_size) in conn.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+            if (not self._max_entries or count <= self._max_entries) and (not self._max_size or size <= self._max_size):
+                break
+            self._delete(conn, key)
+            count -= 1
+            size -= entry_size
+            self._stats.evictions += 1
+
+    def delete(self, key):
+        with self._connection() as conn:
+            self._delete(conn, key)
+
+    def invalidate(self, tag):
+        with self._connection() as conn:
+            # Both statements only visit the rows of the tag, through the
+            # tags primary key and the entries and tags_key indexes
+            conn.execute("DELETE FROM entries WHERE key IN (SELECT key FROM tags WHERE tag = ?)", (tag,))
+            conn.execute("DELETE FROM tags WHERE key IN (SELECT key FROM tags WHERE tag = ?)", (tag,))
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM tags")
+
+    def stats(self):
+        result = BaseCache.stats(self)
+        (count, size) = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        result['entries'] = count
+        result['size'] = size
+        return result
+
+
+_backends = {
+    'memory': MemoryCache,
+    'sqlite': SqliteCache
+}
+
+
+def create_cache(config):
+    """ Create the cache backend named by the configuration. """
+    config = Config(config)
+    backend = config.get('backend', 'memory')
+    if not backend in _backends:
+        raise CacheError("Unknown cache backend: {0}".format(backend))
+    return _backends[backend](config)
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_default_cache():
+    """ Get the cache used by @cached when none is given. """
+    global _default_cache
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = MemoryCache()
+    return _default_cache
+
+
+def set_default_cache(cache):
+    """ Set the cache used by @cached when none is given. """
+    global _default_cache
+    _default_cache = cache
+
+
+def _make_key(args, kwargs):
+    return repr((args, sorted(kwargs.items())))
+
+
+def cached(ttl=None, key=None, tags=None, cache=None):
+    """ Memoize the results of a function.
+
+        Parameters:
+
+            ttl -- Seconds to keep a result.  None uses the cache default.
+            key -- Callable taking the function arguments and returning the
+                   key.  The default is built from the repr of the arguments.
+            tags -- A list of tags, or a callable taking the function arguments
+                    and returning one, that can be invalidated as a group.
+            cache -- The cache to use.  The default cache is used if None.
+
+        The decorated function has an invalidate method taking the same
+        arguments that removes the stored result.
+    """
+
+    def decorator(fn):
+        prefix = "{0}.{1}:".format(fn.__module__, getattr(fn, '__qualname__', fn.__name__))
+
+        def build_key(args, kwargs):
+            return prefix + (str(key(*args, **kwargs)) if key is not None else _make_key(args, kwargs))
+
+        def get_cache():
+            return cache if cache is not None else get_default_cache()
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            target = get_cache()
+            k = build_key(args, kwargs)
+
+            value = target.get(k, _MISSING)
+            if value is _MISSING:
+                value = fn(*args, **kwargs)
+                target.set(k, value, ttl, tags(*args, **kwargs) if callable(tags) else tags)
+            return value
+
+        def invalidate(*args, **kwargs):
+            get_cache().delete(build_key(args, kwargs))
+
+        wrapper.invalidate = invalidate
+        return wrapper
+
+    return decorator
@@ -0,0 +1,291 @@
+"""
+Pooled database connections.
+
+Pools are configured through the application configuration under the
+'db.<name>' key:
+
+    db.<name>.driver        -- The DB-API module used to connect, default 'sqlite3'
+    db.<name>.params        -- Dictionary of keyword arguments passed to connect().
+                               For sqlite3, check_same_thread defaults to False
+                               as pooled connections move between threads.
+    db.<name>.pool_size     -- Number of idle connections kept open
+    db.<name>.max_overflow  -- Extra connections allowed above pool_size
+    db.<name>.recycle       -- Seconds after which a connection is reopened, -1 to never
+    db.<name>.timeout       -- Seconds to wait for a free connection
+
+A connection is only checked out of a pool the first time a request asks
+for it, and is returned when the application has finished with the request.
+"""
+
+import collections
+import importlib
+import threading
+import time
+
+from .config import Config
+from .error import Error
+
+# Intervals are measured with a clock that does not jump
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class PoolError(Error):
+    """ An error with a connection pool. """
+    pass
+
+
+class PoolTimeout(PoolError):
+    """ No connection became available within the pool timeout. """
+    pass
+
+
+class PoolStats(object):
+    """ Wait time and usage counters for a pool. """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, wait, blocked):
+        """ Record a checkout, and how long it waited if it had to block
+            for a connection to be released.
+        """
+        self.checkouts += 1
+        if blocked:
+            self.waits += 1
+            self.wait_total += wait
+            if wait > self.wait_max:
+                self.wait_max = wait
+
+    def as_dict(self):
+        """ Return the counters as a dictionary. """
+        return {
+            'checkouts': self.checkouts,
+            'connects': self.connects,
+            'timeouts': self.timeouts,
+            'waits': self.waits,
+            'wait_total': self.wait_total,
+            'wait_max': self.wait_max,
+            'wait_avg': (self.wait_total / self.waits) if self.waits else 0.0
+        }
+
+
+def _connector(config):
+    """ Build the connect callable for a pool configuration. """
+    driver = config.get('driver', 'sqlite3')
+    module = importlib.import_module(driver)
+    params = dict(config.get('params', {}))
+    if driver == 'sqlite3':
+        params.setdefault('check_same_thread', False)
+
+    def connect():
+        return module.connect(**params)
+
+    return connect
+
+
+class _PoolBase(object):
+    """ Bookkeeping shared by the thread and asyncio pools. """
+
+    _default_config = {
+        'driver': 'sqlite3',
+        'pool_size': 5,
+        'max_overflow': 10,
+        'recycle': -1,
+        'timeout': 30.0
+    }
+
+    def __init__(self, config, connect=None):
+        """ Create the pool.
+
+            Parameters:
+
+                config -- The configuration for this pool.
+                connect -- Optional callable returning a new connection.  If
+                           not specified, the configured driver is used.
+        """
+        self._config = Config(self._default_config, config)
+        self._connect = connect if connect is not None else _connector(self._config)
+        self._pool_size = int(self._config.get('pool_size'))
+        self._max_overflow = int(self._config.get('max_overflow'))
+        self._recycle = float(self._config.get('recycle'))
+        self._timeout = float(self._config.get('timeout'))
+
+        self._idle = collections.deque() # (connection, created)
+        self._created = {} # id(connection) -> created
+        self._checked_out = 0
+        self._stats = PoolStats()
+
+    def _take_idle(self):
+        """ Take the most recently used idle connection, or None. """
+        while self._idle:
+            (conn, created) = self._idle.pop()
+            if self._recycle < 0 or _clock() - created < self._recycle:
+                self._checked_out += 1
+                return conn
+            self._close(conn)
+        return None
+
+    def _can_create(self):
+        return self._checked_out < self._pool_size + self._max_overflow
+
+    def _opened(self, conn):
+        """ Record a newly opened connection. """
+        self._created[id(conn)] = _clock()
+        self._stats.connects += 1
+
+    def _returned(self, conn, broken):
+        """ Put a connection back after use, closing it if not kept. """
+        self._checked_out -= 1
+        created = self._created.get(id(conn))
+        if broken or created is None or len(self._idle) >= self._pool_size:
+            self._close(conn)
+        else:
+            self._idle.append((conn, created))
+
+    def _reset(self, conn):
+        """ Roll back anything left uncommitted.  Returns False if the
+            connection is no longer usable.
+        """
+        try:
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _close(self, conn):
+        self._created.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        """ Return pool usage and wait time metrics. """
+        result = self._stats.as_dict()
+        result['idle'] = len(self._idle)
+        result['checked_out'] = self._checked_out
+        return result
+
+
+class ConnectionPool(_PoolBase):
+    """ A thread safe pool of DB-API connections. """
+
+    def __init__(self, config, connect=None):
+        _PoolBase.__init__(self, config, connect)
+        self._lock = threading.Condition(threading.Lock())
+
+    def acquire(self):
+        """ Check a connection out of the pool. """
+        start = _clock()
+        deadline = start + self._timeout
+        blocked = False
+
+        with self._lock:
+            while True:
+                conn = self._take_idle()
+                if conn is not None:
+                    self._stats.record_wait(_clock() - start, blocked)
+                    return conn
+
+                if self._can_create():
+                    # Reserve the slot, but connect outside of the lock
+                    self._checked_out += 1
+                    break
+
+                remaining = deadline - _clock()
+                if remaining <= 0:
+                    self._stats.timeouts += 1
+                    raise PoolTimeout("Timed out waiting for a database connection")
+                blocked = True
+                self._lock.wait(remaining)
+
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._lock:
+                self._checked_out -= 1
+                self._lock.notify()
+            raise
+
+        with self._lock:
+            self._opened(conn)
+            self._stats.record_wait(_clock() - start, blocked)
+        return conn
+
+    def release(self, conn):
+        """ Return a connection to the pool. """
+        broken = not self._reset(conn)
+        with self._lock:
+            self._returned(conn, broken)
+            self._lock.notify()
+
+    def dispose(self):
+        """ Close all idle connections. """
+        with self._lock:
+            while self._idle:
+                self._close(self._idle.pop()[0])
+
+
+class PoolManager(object):
+    """ Create the configured pools on first use. """
+
+    def __init__(self, config, pool_class=ConnectionPool):
+        self._config = Config(config)
+        self._pool_class = pool_class
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """ Get the pool for the named database. """
+        pool = self._pools.get(name)
+        if pool is not None:
+            return pool
+
+        with self._lock:
+            pool = self._pools.get(name)
+            if pool is None:
+                config = self._config.get('db.' + name)
+                if config is None:
+                    raise PoolError("No database configured: {0}".format(name))
+                pool = self._pool_class(config)
+                self._pools[name] = pool
+            return pool
+
+    def stats(self):
+        """ Return the metrics of every pool created so far. """
+        return dict((name, pool.stats()) for (name, pool) in list(self._pools.items()))
+
+    def dispose(self):
+        """ Close the idle connections of all pools. """
+        for pool in list(self._pools.values()):
+            pool.dispose()
+
+
+class Connections(object):
+    """ The connections checked out for a single request. """
+
+    def __init__(self, manager):
+        self._manager = manager
+        self._connections = {}
+
+    def get(self, name):
+        """ Get the connection for the named database, checking one out of
+            the pool the first time it is asked for.
+        """
+        conn = self._connections.get(name)
+        if conn is None:
+            conn = self._manager.get(name).acquire()
+            self._connections[name] = conn
+        return conn
+
+    def release(self):
+        """ Return all checked out connections to their pools. """
+        connections = self._connections
+        self._connections = {}
+        for name in connections:
+            self._manager.get(name).release(connections[name])
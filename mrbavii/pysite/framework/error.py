@@ -0,0 +1,7 @@
+"""
+Error classes.
+"""
+
+class Error(Exception):
+    """ Base error class for the framework. """
+    pass
@@ -0,0 +1,121 @@
+"""
+Precompiled template manifests.
+
+A manifest holds the compiled code of a set of templates so that a worker
+can load all of them with a single marshal read instead of compiling each
+template on first use.  Marshal data is only valid for the Python version
+that wrote it, so the manifest records the bytecode magic number and is
+rejected if it does not match.  The escaping mode and encoding the templates
+were compiled with are recorded too, and a template loader configured
+differently rejects the manifest.
+
+Build a manifest at deploy time:
+
+    python -m mrbavii.pysite.framework.manifest [--autoescape html|none]
+        [--encoding utf-8] templates.manifest templates/
+
+And pass it to the template loader in the worker:
+
+    loader = TemplateLoader(config, load_manifest('templates.manifest'))
+"""
+
+import argparse
+import marshal
+import os
+
+from .error import Error
+from .template import _TemplateCompiler
+
+try:
+    from importlib.util import MAGIC_NUMBER as _MAGIC
+except ImportError:
+    from imp import get_magic
+    _MAGIC = get_magic()
+
+
+MANIFEST_VERSION = 4
+
+
+class ManifestError(Error):
+    """ The manifest can not be used. """
+    pass
+
+
+def build_manifest(filename, path, autoescape='html', encoding='utf-8'):
+    """ Compile every template below a directory and write a manifest.
+
+        Parameters:
+
+            filename -- The manifest file to write.
+            path -- The template directory.  Templates are named by their
+                    path relative to this directory.
+            autoescape -- The escaping mode, as 'template.autoescape'.
+            encoding -- The output encoding, as 'template.encoding'.
+
+        Returns:
+
+            The names of the compiled templates.
+    """
+    templates = {}
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        for name in filenames:
+            fullname = os.path.join(dirpath, name)
+            relname = os.path.relpath(fullname, path).replace(os.sep, '/')
+            templates[relname] = _TemplateCompiler(autoescape, encoding).compile(fullname)
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'magic': _MAGIC,
+        'autoescape': autoescape,
+        'encoding': encoding,
+        'templates': templates
+    }
+
+    # Write to a temporary file first so a worker never reads a partial file
+    temp = filename + '.temp'
+    with open(temp, 'wb') as handle:
+        marshal.dump(manifest, handle)
+    os.rename(temp, filename)
+
+    return sorted(templates)
+
+
+def load_manifest(filename):
+    """ Load a manifest.
+
+        Returns:
+
+            A dictionary of the 'autoescape' mode and 'encoding' used to
+            compile the templates, and the compiled 'templates' by name.
+    """
+    with open(filename, 'rb') as handle:
+        try:
+            manifest = marshal.load(handle)
+        except (EOFError, ValueError, TypeError):
+            raise ManifestError("Invalid manifest: {0}".format(filename))
+
+    if not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_VERSION:
+        raise ManifestError("Unsupported manifest version: {0}".format(filename))
+
+    if manifest.get('magic') != _MAGIC:
+        raise ManifestError("Manifest built by a different Python version: {0}".format(filename))
+
+    return {
+        'autoescape': manifest['autoescape'],
+        'encoding': manifest['encoding'],
+        'templates': manifest['templates']
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a precompiled template manifest.")
+    parser.add_argument('manifest', help="The manifest file to write")
+    parser.add_argument('path', help="The template directory")
+    parser.add_argument('--autoescape', choices=('html', 'none'), default='html',
+                        help="The escaping mode, as template.autoescape (default html)")
+    parser.add_argument('--encoding', default='utf-8',
+                        help="The output encoding, as template.encoding (default utf-8)")
+    args = parser.parse_args()
+
+    for name in build_manifest(args.manifest, args.path, args.autoescape, args.encoding):
+        print(name)
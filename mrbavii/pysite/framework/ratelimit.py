@@ -0,0 +1,208 @@
+"""
+Rate limiting and load shedding.
+
+RateLimitApplication wraps another application, such as a ProxyApplication
+or an Application, and is configured under the 'ratelimit' key:
+
+    ratelimit.client.rate   -- Requests per second allowed for each client, 0 for no limit
+    ratelimit.client.burst  -- Requests a client may make at once
+    ratelimit.client.key    -- The environ item identifying the client, default REMOTE_ADDR
+    ratelimit.routes        -- A list of route limits, each a dictionary with
+                               'path', 'rate', 'burst', and optionally
+                               'per_client' (default True).  A route rate of 0
+                               never refills, so the route is denied once the
+                               burst is used
+    ratelimit.max_inflight  -- Requests handled at once before shedding with 503, 0 for no limit
+    ratelimit.retry_after   -- Retry-After seconds sent when shedding load, or
+                               when a bucket that never refills is empty
+    ratelimit.slots         -- Number of token buckets
+    ratelimit.shared        -- Keep the buckets in shared memory so the limits
+                               hold across workers forked after creation
+
+Requests over a limit receive 429 with a Retry-After header.
+"""
+
+import math
+import mmap
+import threading
+import time
+import zlib
+
+from .config import Config
+from .app import BaseApplication
+from .response import REASON_PHRASES
+from .util import ClosingIterator
+
+
+class TokenBuckets(object):
+    """ A fixed size table of token buckets.
+
+        Each bucket is two doubles in a flat array: the tokens left and the
+        time they were last updated.  Keys are hashed to a slot, so keys that
+        collide share a bucket; the table should have many more slots than
+        active keys.  In shared mode the array is an anonymous shared mapping
+        and the lock a process lock, both inherited by forked workers.
+    """
+
+    def __init__(self, slots, shared=False):
+        self._slots = slots
+        size = slots * 2 * 8
+
+        if shared:
+            import multiprocessing
+            self._buffer = mmap.mmap(-1, size)
+            self._lock = multiprocessing.Lock()
+        else:
+            self._buffer = bytearray(size)
+            self._lock = threading.Lock()
+
+        self._cells = memoryview(self._buffer).cast('d')
+
+    def slot(self, key):
+        """ Determine the slot for a key.  This is stable across processes. """
+        return zlib.crc32(key.encode('utf-8')) % self._slots
+
+    def take(self, key, rate, burst, now=None):
+        """ Take a token from a bucket.
+
+            Returns:
+
+                0 if the token was taken, otherwise the number of seconds
+                until one will be available.  This is infinite if the rate
+                is not positive and the bucket is empty.
+        """
+        if now is None:
+            now = time.time()
+        index = self.slot(key) * 2
+        cells = self._cells
+
+        with self._lock:
+            updated = cells[index + 1]
+            if updated == 0.0:
+                tokens = float(burst)
+            elif rate <= 0:
+                tokens = min(float(burst), cells[index])
+            else:
+                tokens = min(float(burst), cells[index] + (now - updated) * rate)
+
+            cells[index + 1] = now
+            if tokens >= 1.0:
+                cells[index] = tokens - 1.0
+                return 0
+            else:
+                cells[index] = tokens
+                if rate <= 0:
+                    return float('inf')
+                return (1.0 - tokens) / rate
+
+
+class RateLimitApplication(BaseApplication):
+    """ An application that limits the requests passed to another. """
+
+    _default_config = {
+        'ratelimit.client.rate': 0,
+        'ratelimit.client.burst': 10,
+        'ratelimit.client.key': 'REMOTE_ADDR',
+        'ratelimit.max_inflight': 0,
+        'ratelimit.retry_after': 1,
+        'ratelimit.slots': 65536,
+        'ratelimit.shared': False
+    }
+
+    def __init__(self, config, app):
+        """ Create the rate limiting application wrapping app. """
+        BaseApplication.__init__(self)
+        self._config = Config(self._default_config, config)
+        self._app = app
+
+        self._client_rate = float(self._config.get('ratelimit.client.rate'))
+        self._client_burst = float(self._config.get('ratelimit.client.burst'))
+        self._client_key = self._config.get('ratelimit.client.key')
+        self._routes = []
+        for route in self._config.get('ratelimit.routes', ()):
+            self._routes.append(('/' + route['path'].strip('/'),
+                                 float(route['rate']),
+                                 float(route.get('burst', route['rate'])),
+                                 route.get('per_client', True)))
+
+        self._max_inflight = int(self._config.get('ratelimit.max_inflight'))
+        self._retry_after = str(self._config.get('ratelimit.retry_after'))
+        self._inflight = 0
+        self._inflight_lock = threading.Lock()
+
+        self._buckets = TokenBuckets(int(self._config.get('ratelimit.slots')),
+                                     bool(self._config.get('ratelimit.shared')))
+
+    def check(self, environ):
+        """ Check the limits for a request.
+
+            Returns:
+
+                0 if the request is allowed, otherwise the seconds until the
+                client should retry.
+        """
+        now = time.time()
+        client = environ.get(self._client_key, '')
+
+        if self._client_rate > 0:
+            wait = self._buckets.take('c:' + client, self._client_rate, self._client_burst, now)
+            if wait:
+                return wait
+
+        path_info = environ.get('PATH_INFO', '/')
+        for (path, rate, burst, per_client) in self._routes:
+            if path_info.startswith(path) and path_info[len(path):len(path)+1] in ('', '/'):
+                key = 'r:' + path + (':' + client if per_client else '')
+                wait = self._buckets.take(key, rate, burst, now)
+                if wait:
+                    return wait
+                break
+
+        return 0
+
+    def __call__(self, environ, start_response):
+        """ Check the limits and pass the request on if allowed. """
+        self.fix_environ(environ)
+
+        wait = self.check(environ)
+        if wait:
+            if math.isinf(wait):
+                return self.reject(start_response, 429, self._retry_after)
+            return self.reject(start_response, 429, str(int(math.ceil(wait))))
+
+        if self._max_inflight <= 0:
+            return self._app(environ, start_response)
+
+        with self._inflight_lock:
+            if self._inflight >= self._max_inflight:
+                shed = True
+            else:
+                shed = False
+                self._inflight += 1
+
+        if shed:
+            return self.reject(start_response, 503, self._retry_after)
+
+        try:
+            result = self._app(environ, start_response)
+        except:
+            self.finished()
+            raise
+
+        return ClosingIterator(result, self.finished)
+
+    def finished(self):
+        """ Called when an in-flight request has completed. """
+        with self._inflight_lock:
+            self._inflight -= 1
+
+    def reject(self, start_response, status, retry_after):
+        """ Send a rejection without calling the wrapped application. """
+        reason = REASON_PHRASES[status]
+        body = reason.encode('utf-8')
+        start_response("{0} {1}".format(status, reason), [
+            ('Content-Type', 'text/plain; charset=utf-8'),
+            ('Content-Length', str(len(body))),
+            ('Retry-After', retry_after)
+        ])
+        return [body]
@@ -5,18 +5,64 @@ This is the code providing request.
 import time
 
 from .config import Config
+from .db import Connections, PoolError
+from .tasks import TaskError
 
 class BaseRequest(object):
     """ A base request class. """
-    def __init__(self, config, environ):
+    def __init__(self, config, environ, pools=None, tasks=None):
         """ Initialize the request object. 
             
             Parameters:
 
                 config -- The configuration object.
+                pools -- The database pool manager, if any.
+                tasks -- The background task executor, if any.
         """
         self._config = config
         self._timer = time.time()
+        self.pathinfo = environ.get('PATH_INFO', '/')
+        self.route = None
+        self._connections = Connections(pools) if pools is not None else None
+        self._tasks = tasks
+        self._deferred = []
+
+    def db(self, name='default'):
+        """ Get a database connection, checked out of the pool on first use. """
+        if self._connections is None:
+            raise PoolError("No database pools available to the request")
+        return self._connections.get(name)
+
+    def defer(self, fn, *args, **kwargs):
+        """ Run a callable on the thread pool after the response is closed. """
+        self._defer(False, fn, args, kwargs)
+
+    def defer_process(self, fn, *args, **kwargs):
+        """ Run a picklable callable on the process pool after the response
+            is closed.
+        """
+        self._defer(True, fn, args, kwargs)
+
+    def _defer(self, process, fn, args, kwargs):
+        if self._tasks is None:
+            raise TaskError("No task executor available to the request")
+        self._deferred.append((process, fn, args, kwargs))
+
+    def close(self, run_deferred=True):
+        """ Release any resources held by the request, then submit the
+            deferred tasks unless run_deferred is False.
+        """
+        if self._connections is not None:
+            self._connections.release()
+
+        deferred = self._deferred
+        self._deferred = []
+        if run_deferred:
+            for (process, fn, args, kwargs) in deferred:
+                if process:
+                    self._tasks.submit_process(fn, *args, **kwargs)
+                else:
+                    self._tasks.submit(fn, *args, **kwargs)
 
     def clock(self):
         """ Determine the time of the request so far. """
@@ -2,7 +2,18 @@
 Implementation of a response.
 """
 
+import codecs
+import io
+import os
+import stat
+
 from .config import Config
+from .compat import PY2
+
+if PY2:
+    _text = unicode
+else:
+    _text = str
 
 # HTTP Status codes, borrowed from Django
 REASON_PHRASES = {
@@ -78,7 +89,6 @@ class Response(object):
         self._headers = {}
         self._cookies = {}
         self._body = None
-        self._sendfile = None
 
         # Set status
         if not status is None:
@@ -95,18 +105,111 @@ class Response(object):
         self._headers['Content-Type'] = content_type
 
     def sendbody(self, body):
+        """ Set the body to send.
+
+            The body may be a string, bytes, an iterable or generator of
+            strings or bytes, or a file-like object.  Strings are encoded to
+            the response charset as they are sent.
+        """
         self._body = body
-        self._sendfile = None
 
     def sendfile(self, file):
-        self._sendfile = file
-        self._body = None
+        """ Send a file as the body.
+
+            The file may be a filename, which is opened in binary mode, or a
+            file-like object.  It is read in blocks as it is sent and closed
+            along with the response.
+        """
+        if isinstance(file, (_text, bytes)):
+            file = open(file, 'rb')
+        self._body = file
+
+    def _encoding(self):
+        return self._charset or self._config.get('server.response.default.encoding', 'utf-8')
+
+    def _content_length(self):
+        """ Determine the body length if it is cheap to know, or None. """
+        body = self._body
+        if body is None:
+            return 0
+
+        if isinstance(body, _text):
+            # Encoded here once instead of while sending
+            body = self._body = body.encode(self._encoding())
+
+        if isinstance(body, bytes):
+            return len(body)
+
+        if isinstance(body, (list, tuple)):
+            if all(isinstance(i, bytes) for i in body):
+                return sum(len(i) for i in body)
+            return None
+
+        if isinstance(body, (io.RawIOBase, io.BufferedIOBase)):
+            try:
+                st = os.fstat(body.fileno())
+                # Devices, pipes and sockets have no meaningful size
+                if stat.S_ISREG(st.st_mode):
+                    return st.st_size - body.tell()
+            except (AttributeError, IOError, OSError, ValueError):
+                pass
+            return None
+
+        return None
 
     def prepare(self):
         """ Prepare for sending. """
+        if not 'Content-Length' in self._headers:
+            length = self._content_length()
+            if length is not None:
+                self._headers['Content-Length'] = str(length)
+
         return self._headers
 
-        
+    def __iter__(self):
+        """ Iterate the body as encoded chunks. """
+        body = self._body
+        if body is None:
+            return
+
+        if isinstance(body, bytes):
+            if body:
+                yield body
+            return
+
+        if isinstance(body, _text):
+            body = [body]
+        elif hasattr(body, 'read'):
+            body = self._read_blocks(body)
+
+        encoder = None
+        for chunk in body:
+            if not isinstance(chunk, bytes):
+                if encoder is None:
+                    encoder = codecs.getincrementalencoder(self._encoding())()
+                chunk = encoder.encode(chunk)
+            if chunk:
+                yield chunk
+
+        if encoder is not None:
+            chunk = encoder.encode(_text(), True)
+            if chunk:
+                yield chunk
+
+    def _read_blocks(self, handle):
+        block_size = int(self._config.get('server.response.block_size', 65536))
+        while True:
+            block = handle.read(block_size)
+            if not block:
+                break
+            yield block
+
+    def close(self):
+        """ Close the body, freeing any resources it holds. """
+        body = self._body
+        if hasattr(body, 'close'):
+            body.close()
+
 
 class DefaultResponse(Response):
     def __init__(self, config, status):
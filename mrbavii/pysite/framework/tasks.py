@@ -0,0 +1,277 @@
+"""
+Background tasks run after the response has been sent.
+
+The executor is configured through the application configuration under the
+'tasks' key:
+
+    tasks.mode              -- 'thread' to run tasks in a thread pool, or
+                               'sync' to run them immediately, as for tests
+    tasks.threads           -- Number of worker threads
+    tasks.processes         -- Number of worker processes for CPU heavy tasks
+    tasks.queue_size        -- Maximum tasks waiting to run in each pool
+    tasks.submit_timeout    -- Seconds to wait for room in a full queue before
+                               rejecting a task, 0 to reject immediately
+
+Workers are started on first use, so an executor created before a prefork
+server forks its workers gets its own threads in each worker.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .config import Config
+from .error import Error
+
+
+logger = logging.getLogger(__name__)
+
+
+class TaskError(Error):
+    """ An error with the task executor. """
+    pass
+
+
+class TaskStats(object):
+    """ Queue depth and latency counters for an executor. """
+
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.run_total = 0.0
+
+    def record(self, queued, started, finished, failed):
+        """ Record a finished task. """
+        latency = finished - queued
+        self.completed += 1
+        if failed:
+            self.failed += 1
+        self.latency_total += latency
+        self.run_total += finished - started
+        if latency > self.latency_max:
+            self.latency_max = latency
+
+    def as_dict(self):
+        """ Return the counters as a dictionary. """
+        return {
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'latency_avg': (self.latency_total / self.completed) if self.completed else 0.0,
+            'latency_max': self.latency_max,
+            'run_avg': (self.run_total / self.completed) if self.completed else 0.0
+        }
+
+
+_STOP = object()
+
+
+class TaskExecutor(object):
+    """ Run callables in bounded thread and process pools. """
+
+    _default_config = {
+        'mode': 'thread',
+        'threads': 4,
+        'processes': 2,
+        'queue_size': 1000,
+        'submit_timeout': 0
+    }
+
+    def __init__(self, config=None):
+        self._config = Config(self._default_config, config)
+        self._mode = self._config.get('mode')
+        if not self._mode in ('thread', 'sync'):
+            raise TaskError("Unknown task mode: {0}".format(self._mode))
+
+        self._threads = int(self._config.get('threads'))
+        self._processes = int(self._config.get('processes'))
+        self._queue_size = int(self._config.get('queue_size'))
+        self._submit_timeout = float(self._config.get('submit_timeout'))
+
+        self._lock = threading.Lock()
+        self._stats = TaskStats()
+        self._pid = None
+        self._queue = None
+        self._workers = []
+        self._pool = None
+        self._pool_slots = None
+        self._pool_pending = 0
+        self._shutdown = False
+
+    def _start(self):
+        """ Start the workers in this process if not already running. """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        with self._lock:
+            if self._pid == pid:
+                return
+
+            self._queue = queue.Queue(self._queue_size)
+            self._workers = []
+            for i in range(self._threads):
+                worker = threading.Thread(target=self._work, name="task-worker-{0}".format(i))
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+            self._pool = None
+            self._pool_slots = threading.BoundedSemaphore(self._queue_size)
+            self._pool_pending = 0
+
+            if self._pid is None:
+                atexit.register(self.shutdown)
+            self._pid = pid
+
+    def _work(self):
+        """ Worker thread loop. """
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            (queued, fn, args, kwargs) = item
+            self._run(queued, fn, args, kwargs)
+
+    def _run(self, queued, fn, args, kwargs):
+        started = time.time()
+        failed = False
+        try:
+            fn(*args, **kwargs)
+        except Exception:
+            failed = True
+            logger.exception("Background task failed: %r", fn)
+
+        with self._lock:
+            self._stats.record(queued, started, time.time(), failed)
+
+    def submit(self, fn, *args, **kwargs):
+        """ Queue a callable to run on the thread pool.
+
+            Returns:
+
+                True if the task was queued, or False if the queue was full.
+        """
+        if self._shutdown:
+            raise TaskError("The task executor has been shut down")
+
+        queued = time.time()
+        with self._lock:
+            self._stats.submitted += 1
+
+        if self._mode == 'sync':
+            self._run(queued, fn, args, kwargs)
+            return True
+
+        self._start()
+        try:
+            self._queue.put((queued, fn, args, kwargs), self._submit_timeout > 0, self._submit_timeout or None)
+        except queue.Full:
+            with self._lock:
+                self._stats.rejected += 1
+            logger.warning("Background task queue full, rejected: %r", fn)
+            return False
+        return True
+
+    def submit_process(self, fn, *args, **kwargs):
+        """ Queue a callable to run on the process pool.  The callable and
+            arguments must be picklable.
+
+            Returns:
+
+                True if the task was queued, or False if the queue was full.
+        """
+        if self._shutdown:
+            raise TaskError("The task executor has been shut down")
+
+        queued = time.time()
+        with self._lock:
+            self._stats.submitted += 1
+
+        if self._mode == 'sync':
+            self._run(queued, fn, args, kwargs)
+            return True
+
+        self._start()
+        if not self._pool_slots.acquire(self._submit_timeout > 0, self._submit_timeout or None):
+            with self._lock:
+                self._stats.rejected += 1
+            logger.warning("Background process queue full, rejected: %r", fn)
+            return False
+
+        with self._lock:
+            if self._pool is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self._pool = ProcessPoolExecutor(self._processes)
+            self._pool_pending += 1
+            pool = self._pool
+
+        def done(future):
+            failed = future.exception() is not None
+            if failed:
+                logger.error("Background task failed: %r: %r", fn, future.exception())
+            with self._lock:
+                self._pool_pending -= 1
+                # Run time is not known for process tasks, count it all as latency
+                self._stats.record(queued, queued, time.time(), failed)
+            self._pool_slots.release()
+
+        try:
+            future = pool.submit(fn, *args, **kwargs)
+        except Exception:
+            # Give the slot back, and start a new pool next time if this
+            # one is broken or was shut down
+            with self._lock:
+                self._pool_pending -= 1
+                self._stats.failed += 1
+                if self._pool is pool:
+                    self._pool = None
+            self._pool_slots.release()
+            raise
+
+        future.add_done_callback(done)
+        return True
+
+    def stats(self):
+        """ Return the queue depth and task latency metrics. """
+        with self._lock:
+            result = self._stats.as_dict()
+            result['queue_depth'] = self._queue.qsize() if self._queue is not None else 0
+            result['process_queue_depth'] = self._pool_pending
+        return result
+
+    def shutdown(self, wait=True):
+        """ Stop accepting tasks and let the queued tasks finish. """
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            running = self._pid == os.getpid()
+            workers = self._workers
+            pool = self._pool
+
+        if not running:
+            return
+
+        # Sentinels are queued behind the remaining tasks
+        for worker in workers:
+            self._queue.put(_STOP)
+
+        if wait:
+            for worker in workers:
+                worker.join()
+
+        if pool is not None:
+            pool.shutdown(wait)
@@ -6,36 +6,246 @@ and then executes the code object with a variables dictionary
 """
 
 import codecs
+import os
+import re
+import string
+import threading
 
+from .compat import u, b, PY2
+from .config import Config
 from .error import Error
 
+if not PY2:
+    unicode = str
+
 class TemplateError(Error):
     pass
 
+
+class Safe(unicode):
+    """ Text that is emitted without escaping. """
+
+    def __html__(self):
+        return self
+
+
+def escape_text(value):
+    """ Escape a value for HTML text content. """
+    if value.__class__ is not unicode:
+        if isinstance(value, Safe):
+            return value
+        value = unicode(value)
+
+    # Most values have nothing to escape, and only '&' and '<' must be
+    if '&' in value or '<' in value:
+        return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return value
+
+
+def escape_attr(value):
+    """ Escape a value for an HTML attribute. """
+    if value.__class__ is not unicode:
+        if isinstance(value, Safe):
+            return value
+        value = unicode(value)
+
+    if '&' in value or '<' in value or '>' in value or '"' in value or "'" in value:
+        return (value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+                     .replace('"', '&#34;').replace("'", '&#39;'))
+    return value
+
+
+# Characters that end or split an unquoted attribute value, or start a tag
+_unquoted_specials = re.compile(u('[&<>"\'`=\\s]'))
+
+
+def _char_ref(match):
+    return u('&#{0};').format(ord(match.group()))
+
+
+def escape_unquoted(value):
+    """ Escape a value for an unquoted HTML attribute, or for where it is not
+        known whether a value is inside a tag.
+    """
+    if value.__class__ is not unicode:
+        if isinstance(value, Safe):
+            return value
+        value = unicode(value)
+
+    return _unquoted_specials.sub(_char_ref, value)
+
+
+def to_text(value):
+    """ Convert a value for output without escaping. """
+    if value.__class__ is unicode:
+        return value
+    return unicode(value)
+
+
+# Characters that start a tag after '<'
+_tag_start = frozenset(string.ascii_letters + '/')
+
+
+# Globals of the compiled render functions
+_runtime = {
+    '_str': unicode,
+    '_int': int,
+    '_escape_text': escape_text,
+    '_escape_attr': escape_attr,
+    '_escape_unquoted': escape_unquoted,
+    '_to_text': to_text
+}
+
+
 class _TemplateCompiler(object):
-    """ This class translates a template into a python code object """
+    """ This class translates a template into a python code object
+
+        Variables are escaped according to where they appear: autoescape
+        'html' escapes them for text content or, inside a tag, for a quoted
+        or unquoted attribute, while 'none' emits them as they are.  Where
+        the context is not certain, such as directly after a '<', the
+        strictest escaping is used.  Each branch of an if, and the body of
+        a for, must end in the context it started in.  Literal text is
+        merged and encoded to bytes at compile time.
+
+        Variables in comments and in <script> and <style> bodies are not
+        supported.  They are escaped as for an attribute, which keeps them
+        from ending the comment or element but is not escaping for
+        JavaScript or CSS.
+    """
+
+    def __init__(self, autoescape='html', encoding='utf-8'):
+        if not autoescape in ('html', 'none'):
+            raise TemplateError("Unknown autoescape mode: {0}".format(autoescape))
+        self._autoescape = autoescape
+        self._encoding = encoding
 
     def reset(self):
         """ Reset internals to an empty state """
-        self._code = ""
-        self._indent = 0
+        self._code = "def render(self):\n"
+        self._indent = 1
         self._line = 0
+        self._text = []
+        self._context = 'text'
+        self._quote = None
+        self._equals = False
+        self._tag = ''
+        self._in_name = False
+        self._tail = ''
+        self._end = ''
+        self._sections = []
+        self.code("_w = self._output.append")
 
     def indent(self):
         """ Increase the indent counter """
+        self.flush_text()
         self._indent += 1
 
     def dedent(self):
         """ Decrease the indent counter """
+        self.flush_text()
         self._indent -= 1
 
     def code(self, s):
         """ Write code, properly indented """
+        self.flush_text()
         self._code += ('    ' * self._indent) + s + '\n'
 
+    def flush_text(self):
+        """ Emit the pending text as a single bytes constant """
+        if self._text:
+            data = u('').join(self._text).encode(self._encoding)
+            self._text = []
+            self.code("_w(" + repr(data) + ")")
+
     def handle_text(self, text):
         """ Create code to emit plain text """
-        self.code("self.write(" + repr(text) + ")")
+        if not text:
+            return
+        self._text.append(text)
+
+        for ch in text:
+            self.track_context(ch)
+
+    def track_context(self, ch):
+        """ Track where a variable that follows the text would appear.
+
+            The context is 'text' for content, 'lt' after a '<' that may
+            start a tag, 'tag' inside a tag, 'markup' inside a declaration,
+            'comment' inside a comment, and 'raw' inside a script or style
+            body.
+        """
+        context = self._context
+        if context == 'text':
+            if ch == '<':
+                self._context = 'lt'
+        elif context == 'lt':
+            # Only a letter, '/' or '!' after '<' starts a tag
+            if ch in _tag_start:
+                self.start_tag(ch.lower())
+            elif ch == '!' or ch == '?':
+                self._context = 'markup'
+                self._tail = ''
+            elif ch != '<':
+                self._context = 'text'
+        elif context == 'tag':
+            if self._quote:
+                if ch == self._quote:
+                    self._quote = None
+            elif self._in_name and ch.isalnum():
+                self._tag += ch.lower()
+            elif ch == '>':
+                if self._tag in ('script', 'style'):
+                    self._context = 'raw'
+                    self._end = '</' + self._tag
+                    self._tail = ''
+                else:
+                    self._context = 'text'
+            else:
+                # The tag name ends at anything else
+                self._in_name = False
+                if (ch == '"' or ch == "'") and self._equals:
+                    self._quote = ch
+                    self._equals = False
+                elif ch == '=':
+                    self._equals = True
+                elif not ch.isspace():
+                    self._equals = False
+        elif context == 'markup':
+            # '<!--' starts a comment, other declarations end at '>'
+            self._tail += ch
+            if self._tail == '--':
+                self._context = 'comment'
+                self._tail = ''
+            elif ch == '>':
+                self._context = 'text'
+        elif context == 'comment':
+            self._tail = (self._tail + ch)[-3:]
+            if self._tail == '-->':
+                self._context = 'text'
+        elif context == 'raw':
+            self._tail = (self._tail + ch.lower())[-len(self._end):]
+            if self._tail == self._end:
+                self.start_tag(self._end[1:])
+                self._in_name = False
+
+    def start_tag(self, name):
+        """ Enter a tag, reading its name from the characters that follow. """
+        self._context = 'tag'
+        self._tag = name
+        self._in_name = True
+        self._quote = None
+        self._equals = False
+
+    def track_var(self):
+        """ Track the context after a variable has been emitted. """
+        if self._context == 'lt':
+            # The variable is the tag name, and the rest is inside the tag
+            self.start_tag('')
+            self._in_name = False
+        elif self._context == 'tag' and not self._quote:
+            self._in_name = False
+            self._equals = False
 
     def handle_if(self, contents):
         """ Create code for the if section """
@@ -50,17 +260,49 @@ class _TemplateCompiler(object):
         self.build_modifiers(name, parts)
         self.code("if " + name + ":")
         self.indent()
+        self._sections.append([self.save_context(), None])
     
     def handle_else(self):
+        self.code("pass")
         self.dedent()
         self.code("else:")
         self.indent()
 
+        # The else branch starts from the context before the if
+        section = self._sections[-1]
+        section[1] = self.save_context()
+        self.restore_context(section[0])
+
     def handle_endif(self):
+        self.code("pass")
         self.dedent()
         var = "var_" + str(self._indent)
         self.code("del " + var)
 
+        (start, branch) = self._sections.pop()
+        self.check_context(branch if branch is not None else start, "if")
+
+    def save_context(self):
+        """ Save the state of the context tracker """
+        return (self._context, self._quote, self._equals, self._tag,
+                self._in_name, self._tail, self._end)
+
+    def restore_context(self, saved):
+        """ Restore a saved state of the context tracker """
+        (self._context, self._quote, self._equals, self._tag,
+         self._in_name, self._tail, self._end) = saved
+
+    def check_context(self, saved, section):
+        """ Check that the context is the same as a saved one.
+
+            Variables are escaped for a single context, so each branch of
+            an if, and the body of a for, must end in the context it
+            started in.
+        """
+        if (self._context, self._quote, self._end) != (saved[0], saved[1], saved[6]):
+            raise TemplateError("The {0} section at line {1} changes the HTML context: {2}".format(
+                section, self._line, self.filename))
+
     def handle_for(self, contents):
         parts = contents.split()
         var = "var_" + str(self._indent)
@@ -68,8 +310,10 @@ class _TemplateCompiler(object):
         iterable = parts.pop(0).strip()
         self.build_var(var, iterable)
         self.code(var + "_idx = 0")
+        self.code(var + "_iter = None")
         self.code("for " + var + "_iter in " + var + ":")
         self.indent()
+        self._sections.append([self.save_context(), None])
         self.code("self.vars['" + name + "'] = " + var + "_iter")
         self.code("self.vars['" + name + "_idx'] = " + var + "_idx")
 
@@ -81,12 +325,16 @@ class _TemplateCompiler(object):
         self.code("del " + var + "_iter")
         self.code("del " + var + "_idx")
 
+        self.check_context(self._sections.pop()[0], "for")
+
     def handle_block(self, content):
         name = content.strip()
         self.code("self.start_block('" + name + "')")
+        self.code("_w = self._output.append")
     
     def handle_endblock(self):
         self.code("self.finish_block()")
+        self.code("_w = self._output.append")
 
     def handle_call(self, contents):
         parts = contents.split(',')
@@ -108,8 +356,43 @@ class _TemplateCompiler(object):
 
         self.build_var("output", var)
         self.build_modifiers("output", parts)
-        self.code("self.write(output)")
+
+        # Strings with nothing to escape and ints are the common cases, and
+        # are handled inline to avoid a function call, testing only the
+        # characters that matter where the variable appears
+        context = self._context
+        if self._autoescape == 'none':
+            self.convert_var(None, "_to_text")
+        elif context == 'text':
+            self.convert_var("'&' in output or '<' in output", "_escape_text")
+        elif context == 'tag' and self._quote:
+            self.convert_var("'&' in output or " + repr(self._quote) + " in output", "_escape_attr")
+        elif context in ('tag', 'lt'):
+            # An unquoted attribute, or what may be the start of a tag
+            self.code("output = _escape_unquoted(output)")
+        else:
+            self.code("output = _escape_attr(output)")
+
+        self.code("_w(output.encode(" + repr(self._encoding) + "))")
         self.code("del output")
+        self.track_var()
+
+    def convert_var(self, check, escape):
+        """ Create code converting output to text.  The escape function is
+            called for strings only if the inline check finds a character
+            to escape, and never for ints.
+        """
+        if check is None:
+            self.code("if output.__class__ is not _str:")
+        else:
+            self.code("if output.__class__ is _str:")
+            self.indent()
+            self.code("if " + check + ": output = " + escape + "(output)")
+            self.dedent()
+            self.code("else:")
+        self.indent()
+        self.code("output = _str(output) if output.__class__ is _int else " + escape + "(output)")
+        self.dedent()
 
     def handle_action(self, contents):
         words = contents.split(None, 1)
@@ -234,9 +517,9 @@ class _TemplateCompiler(object):
         self.handle_text(contents[start:])
 
     def compile(self, filename):
-        """ Compile the entire contents """
+        """ Compile the entire contents into a code object defining render(self) """
         self.reset()
-        with codecs.open(filename, "rU" "UTF-8") as handle:
+        with codecs.open(filename, "r", "UTF-8") as handle:
             self.filename = filename
             line = handle.readline()
             
@@ -246,17 +529,160 @@ class _TemplateCompiler(object):
                 line = handle.readline()
 
         # The results
-        print(self._code)
-
-
+        self.code("pass")
+        self.source = self._code
+        return compile(self._code, filename, "exec")
+
+
+class TemplateLoader(object):
+    """ Find, compile and cache templates.
+
+        Templates are found in the directories listed in 'template.path' and
+        compiled on first use.  A manifest from load_manifest() may be
+        passed in to skip compiling altogether.  It must have been built with
+        the same 'template.autoescape' and 'template.encoding', or
+        ManifestError is raised.
+
+        A loader is thread safe and meant to be shared, for example by an
+        application, while a Template is created for each render.
+    """
+
+    _default_config = {
+        'template.path': [],
+        'template.autoescape': 'html',
+        'template.encoding': 'utf-8'
+    }
+
+    def __init__(self, config, manifest=None):
+        self._config = Config(self._default_config, config)
+        self._autoescape = self._config.get('template.autoescape')
+        self._encoding = self._config.get('template.encoding')
+        self._code = {}
+        if manifest:
+            from .manifest import ManifestError
+            if (manifest['autoescape'], manifest['encoding']) != (self._autoescape, self._encoding):
+                raise ManifestError("Manifest built with autoescape {0!r} and encoding {1!r}".format(
+                    manifest['autoescape'], manifest['encoding']))
+            self._code.update(manifest['templates'])
+        self._renderers = {}
+        self._modifiers = {
+            'safe': Safe,
+            'escape': lambda value: Safe(escape_attr(value))
+        }
+        self._lock = threading.Lock()
+
+    def set_modifier(self, name, fn):
+        """ Register a modifier function for all templates. """
+        self._modifiers[name] = fn
+
+    def find(self, name):
+        """ Find the file for a template. """
+        for path in self._config.get('template.path'):
+            filename = os.path.join(path, name)
+            if os.path.isfile(filename):
+                return filename
+
+        raise TemplateError("Template not found: {0}".format(name))
+
+    def load(self, name):
+        """ Get the render function of a template. """
+        render = self._renderers.get(name)
+        if render is not None:
+            return render
+
+        with self._lock:
+            render = self._renderers.get(name)
+            if render is None:
+                code = self._code.get(name)
+                if code is None:
+                    code = _TemplateCompiler(self._autoescape, self._encoding).compile(self.find(name))
+                    self._code[name] = code
+
+                namespace = dict(_runtime)
+                exec(code, namespace)
+                render = self._renderers[name] = namespace['render']
+
+        return render
+
+    def template(self):
+        """ Create a template to render with. """
+        return Template(self)
+
+
+class Template(object):
+    """ Render templates from a loader with a set of variables.
+
+        A template holds the state of a render, so it is cheap to create
+        and should not be shared between threads.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._encoding = loader._encoding
+        self._modifiers = loader._modifiers
+        self._output = []
+        self._buffers = []
+        self.vars = {}
+
+    def set(self, name, value):
+        """ Set a template variable. """
+        self.vars[name] = value
+
+    def set_modifier(self, name, fn):
+        """ Register a modifier function for this template only. """
+        if self._modifiers is self._loader._modifiers:
+            self._modifiers = dict(self._modifiers)
+        self._modifiers[name] = fn
+
+    def render(self, name):
+        """ Render a template and return the encoded output. """
+        saved = self._output
+        self._output = []
+        try:
+            self._loader.load(name)(self)
+            return b('').join(self._output)
+        finally:
+            self._output = saved
+
+    def build(self, name):
+        """ Render a template and return the output. """
+        return self.render(name).decode(self._encoding)
+
+    # Methods used by the compiled code
+
+    def write(self, output):
+        """ Emit output without escaping. """
+        self._output.append(to_text(output).encode(self._encoding))
+
+    def modify(self, name, value):
+        """ Apply a modifier. """
+        fn = self._modifiers.get(name)
+        if fn is None:
+            raise TemplateError("Unknown modifier: {0}".format(name))
+        return fn(value)
+
+    def call(self, name, params):
+        """ Emit another template with some variables replaced. """
+        saved = dict(self.vars)
+        self.vars.update(params)
+        try:
+            self._loader.load(name)(self)
+        finally:
+            self.vars = saved
+
+    def start_block(self, name):
+        """ Capture output until finish_block into the named variable. """
+        self._buffers.append((name, self._output))
+        self._output = []
+
+    def finish_block(self):
+        """ Finish capturing a block. """
+        (name, output) = self._buffers.pop()
+        self.vars[name] = Safe(b('').join(self._output).decode(self._encoding))
+        self._output = output
 
 
 if __name__ == "__main__":
     t = _TemplateCompiler()
     t.compile("template.test")
-        
-
-
-        
-        
-        
+    print(t.source)
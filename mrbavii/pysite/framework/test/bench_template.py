@@ -0,0 +1,68 @@
+""" Measure the cost of auto-escaping on a variable heavy template.
+
+The overhead printed is the extra render time of autoescape 'html' over
+autoescape 'none', which converts values to text without escaping them.
+"""
+
+import os
+import shutil
+import tempfile
+import timeit
+
+from ..template import TemplateLoader
+
+
+ROWS = 500
+
+source = (
+    '<table>\n'
+    '{%for row rows}<tr class="{$row.kind}"><td>{$row.id}</td><td>{$row.name}</td>'
+    '<td title="{$row.title}">{$row.title}</td><td>{$row.email}</td></tr>\n{%endfor}'
+    '</table>\n'
+)
+
+
+class Row(object):
+    def __init__(self, i, special):
+        self.kind = 'odd' if i % 2 else 'even'
+        self.id = i
+        self.name = 'User <{0}>'.format(i) if special else 'User {0}'.format(i)
+        self.title = 'Tom & "Jerry"' if special else 'Tom and Jerry'
+        self.email = 'user{0}@example.com'.format(i)
+
+
+def bench(path, special):
+    """ Time rendering with and without escaping, interleaved so that both
+        see the same machine load.  Returns the best times in milliseconds.
+    """
+    rows = [Row(i, special) for i in range(ROWS)]
+    templates = {}
+    for autoescape in ('none', 'html'):
+        t = templates[autoescape] = TemplateLoader({'template.path': [path], 'template.autoescape': autoescape}).template()
+        t.set('rows', rows)
+        t.render('table')
+
+    best = {'none': None, 'html': None}
+    for i in range(20):
+        for autoescape in best:
+            t = templates[autoescape]
+            elapsed = timeit.timeit(lambda: t.render('table'), number=20) / 20
+            if best[autoescape] is None or elapsed < best[autoescape]:
+                best[autoescape] = elapsed
+
+    return (best['none'] * 1000, best['html'] * 1000)
+
+
+path = tempfile.mkdtemp()
+try:
+    with open(os.path.join(path, 'table'), 'w') as handle:
+        handle.write(source)
+
+    print("{0} rows, {1} variables per render".format(ROWS, ROWS * 6))
+    for special in (False, True):
+        (plain, escaped) = bench(path, special)
+        print("{0:<22} none {1:7.3f} ms   html {2:7.3f} ms   +{3:.1f}%".format(
+            "values need escaping" if special else "values are plain",
+            plain, escaped, (escaped - plain) * 100.0 / plain))
+finally:
+    shutil.rmtree(path)
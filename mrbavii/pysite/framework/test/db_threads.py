@@ -0,0 +1,80 @@
+""" Check that pooled connections work across threads and asyncio. """
+
+import asyncio
+import threading
+
+from ..aiodb import AsyncConnectionPool
+from ..db import ConnectionPool
+
+
+config = {'pool_size': 1, 'max_overflow': 0, 'params': {'database': ':memory:'}}
+
+
+# Threads share the single pooled connection in turn
+pool = ConnectionPool(config)
+errors = []
+
+def work():
+    try:
+        for i in range(20):
+            conn = pool.acquire()
+            try:
+                conn.execute("SELECT 1").fetchone()
+            finally:
+                pool.release(conn)
+    except Exception as e:
+        errors.append(e)
+
+threads = [threading.Thread(target=work) for i in range(4)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+
+stats = pool.stats()
+assert not errors, errors
+assert stats['connects'] == 1, stats
+assert stats['checkouts'] == 80, stats
+assert stats['waits'] <= stats['checkouts'], stats
+print("threads: {0}".format(stats))
+
+
+# The asyncio pool opens connections in an executor thread
+async def main():
+    apool = AsyncConnectionPool(config)
+    for i in range(5):
+        conn = await apool.acquire()
+        conn.execute("SELECT 1").fetchone()
+        await apool.release(conn)
+    return apool.stats()
+
+stats = asyncio.run(main())
+assert stats['connects'] == 1, stats
+assert stats['waits'] == 0, stats
+print("asyncio: {0}".format(stats))
+
+
+# Drivers with coroutine rollback() and close() are awaited
+events = []
+
+class AsyncConnection(object):
+    async def rollback(self):
+        events.append('rollback')
+
+    async def close(self):
+        events.append('close')
+
+async def connect():
+    return AsyncConnection()
+
+async def main():
+    apool = AsyncConnectionPool({'pool_size': 1, 'max_overflow': 1}, connect)
+    first = await apool.acquire()
+    second = await apool.acquire()
+    await apool.release(first)
+    await apool.release(second)
+    await apool.dispose()
+
+asyncio.run(main())
+assert events == ['rollback', 'rollback', 'close', 'close'], events
+print("async driver: {0}".format(events))
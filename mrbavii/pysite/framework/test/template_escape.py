@@ -0,0 +1,101 @@
+""" Check that template variables are escaped for where they appear. """
+
+import os
+import shutil
+import tempfile
+
+from ..template import Safe, TemplateError, TemplateLoader
+
+
+ATTACK = '" onmouseover="alert(1)'
+SCRIPT = '<script>alert(1)</script>'
+
+# Template source, variables, expected output
+cases = [
+    # Text content
+    ('<p>{$x}</p>', {'x': SCRIPT}, '<p>&lt;script&gt;alert(1)&lt;/script&gt;</p>'),
+    ('<p>{$x}</p>', {'x': ATTACK}, '<p>" onmouseover="alert(1)</p>'),
+    ("<p>if a < b then it's {$x}</p>", {'x': SCRIPT},
+     "<p>if a < b then it's &lt;script&gt;alert(1)&lt;/script&gt;</p>"),
+    ('<p>{$x} {$n}</p>', {'x': 'a & b', 'n': 42}, '<p>a &amp; b 42</p>'),
+
+    # Quoted attributes
+    ('<a title="{$x}">t</a>', {'x': ATTACK}, '<a title="&#34; onmouseover=&#34;alert(1)">t</a>'),
+    ("<a title='{$x}'>t</a>", {'x': "' onclick='alert(1)"}, "<a title='&#39; onclick=&#39;alert(1)'>t</a>"),
+    ('<a title="it\'s {$x}">t</a>', {'x': ATTACK}, '<a title="it\'s &#34; onmouseover=&#34;alert(1)">t</a>'),
+    ('<a title="\n{$x}">t</a>', {'x': ATTACK}, '<a title="\n&#34; onmouseover=&#34;alert(1)">t</a>'),
+
+    # Unquoted attributes and a variable directly after '<'
+    ('<a title={$x}>t</a>', {'x': 'y onmouseover=alert(1)'}, '<a title=y&#32;onmouseover&#61;alert(1)>t</a>'),
+    ('<p>a <{$x}</p>', {'x': 'img src=x onerror=alert(1)'}, '<p>a <img&#32;src&#61;x&#32;onerror&#61;alert(1)</p>'),
+    ('<{$tag} class="{$x}">hi</{$tag}>', {'tag': 'div', 'x': ATTACK},
+     '<div class="&#34; onmouseover=&#34;alert(1)">hi</div>'),
+
+    # Comments, script and style bodies
+    ("<!-- it's {$x} -->", {'x': '--><script>alert(1)</script>'},
+     "<!-- it's --&gt;&lt;script&gt;alert(1)&lt;/script&gt; -->"),
+    ('<!DOCTYPE html><p>{$x}</p>', {'x': SCRIPT}, '<!DOCTYPE html><p>&lt;script&gt;alert(1)&lt;/script&gt;</p>'),
+    ('<script>var s = "{$x}";</script>', {'x': ATTACK}, '<script>var s = "&#34; onmouseover=&#34;alert(1)";</script>'),
+    ('<script type="text/javascript">var s = "{$x}";</script><p>{$x}</p>', {'x': '</script>"'},
+     '<script type="text/javascript">var s = "&lt;/script&gt;&#34;";</script><p>&lt;/script&gt;"</p>'),
+    ('<style>p::after {{} content: "{$x}" {}}</style>', {'x': '</style>"'},
+     '<style>p::after { content: "&lt;/style&gt;&#34;" }</style>'),
+
+    # Values that are not escaped
+    ('<p>{$x}</p>', {'x': Safe('<b>ok</b>')}, '<p><b>ok</b></p>'),
+    ('<p>{$x|safe}</p>', {'x': '<b>ok</b>'}, '<p><b>ok</b></p>'),
+    ('<p>{$x|escape}</p>', {'x': '<b>"ok"</b>'}, '<p>&lt;b&gt;&#34;ok&#34;&lt;/b&gt;</p>'),
+
+    # Sections
+    ('{%block b}<i>{$x}</i>{%endblock}<p>{$b}</p>', {'x': SCRIPT},
+     '<p><i>&lt;script&gt;alert(1)&lt;/script&gt;</i></p>'),
+    ('{%for i items}<li title="{$i}">{$i}</li>{%endfor}', {'items': ['"', '<']},
+     '<li title="&#34;">"</li><li title="<">&lt;</li>'),
+    ('<a {%if c}class="on"{%else}{%endif} title="{$x}">t</a>', {'c': False, 'x': ATTACK},
+     '<a  title="&#34; onmouseover=&#34;alert(1)">t</a>'),
+    ('<p>{%call sub, y=x}</p>', {'x': SCRIPT}, '<p><b>&lt;script&gt;alert(1)&lt;/script&gt;</b></p>'),
+]
+
+# Templates whose sections end in a different context than they start in
+invalid = [
+    '<a {%if c}title="{%else}{%endif}{$x}">t</a>',
+    '{%for i items}<a title="{%endfor}',
+]
+
+
+path = tempfile.mkdtemp()
+try:
+    with open(os.path.join(path, 'sub'), 'w') as handle:
+        handle.write('<b>{$y}</b>')
+
+    for (i, (source, values, expected)) in enumerate(cases):
+        with open(os.path.join(path, 'case{0}'.format(i)), 'w') as handle:
+            handle.write(source)
+
+    loader = TemplateLoader({'template.path': [path]})
+    for (i, (source, values, expected)) in enumerate(cases):
+        t = loader.template()
+        for name in values:
+            t.set(name, values[name])
+        output = t.build('case{0}'.format(i))
+        assert output == expected, (source, output, expected)
+
+    # Nothing is escaped with autoescape 'none'
+    loader = TemplateLoader({'template.path': [path], 'template.autoescape': 'none'})
+    t = loader.template()
+    t.set('x', SCRIPT)
+    assert t.build('case0') == '<p>' + SCRIPT + '</p>'
+
+    for (i, source) in enumerate(invalid):
+        with open(os.path.join(path, 'invalid{0}'.format(i)), 'w') as handle:
+            handle.write(source)
+        try:
+            TemplateLoader({'template.path': [path]}).load('invalid{0}'.format(i))
+        except TemplateError:
+            pass
+        else:
+            raise AssertionError("Compiled: " + source)
+finally:
+    shutil.rmtree(path)
+
+print("{0} escaping cases passed".format(len(cases) + len(invalid) + 1))
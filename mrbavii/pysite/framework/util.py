@@ -15,3 +15,32 @@ def convert_from_bytes(raw, encoding):
         return raw.decode(encoding)
     return raw
 
+
+class ClosingIterator(object):
+    """ Wrap a WSGI response iterable to run callbacks when it is closed.
+        The wrapped iterable's own close method is called first, as required
+        by the WSGI specification.
+    """
+
+    def __init__(self, iterable, *callbacks):
+        self._iterable = iterable
+        self._iterator = iter(iterable)
+        self._callbacks = list(callbacks)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    next = __next__ # Python 2
+
+    def close(self):
+        callbacks = self._callbacks
+        self._callbacks = []
+        try:
+            if hasattr(self._iterable, 'close'):
+                self._iterable.close()
+        finally:
+            for callback in callbacks:
+                callback()
@@ -2,9 +2,7 @@ from setuptools import setup
 
 setup(
     version = '0.0',
-    namespace_packages = ["mrbavii"],
     name = 'mrbavii.pysite',
-    description = 'A set of Python site helper classes and applications',
-    install_requires = ['setuptools']
+    description = 'A set of Python site helper classes and applications'
 )
 